@@ -11,17 +11,305 @@ import json
 import os
 import sys
 import re
-import smtplib
+import copy
+import select
+import heapq
+import threading
+from io import StringIO
+from operator import itemgetter
+from types import MappingProxyType
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Tuple, Any
 from datetime import datetime
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email.utils import formatdate
-from email import encoders
-import glob
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+# orjson (optionnel) est nettement plus rapide que json pour le chargement ;
+# json.loads accepte aussi directement des bytes
+try:
+    import orjson
+    _jloads = orjson.loads
+except ImportError:
+    _jloads = json.loads
+
+# Nombre maximal de connexions SSH en cours d'authentification simultanément
+# (reste sous le MaxStartups par défaut de sshd, 10 connexions non authentifiées)
+_CONNECT_SEMAPHORE = threading.Semaphore(8)
+
+# Politique de clé d'hôte sans état, partagée par toutes les connexions
+_AUTO_POLICY = paramiko.AutoAddPolicy()
+
+# Options de connexion : authentification par mot de passe uniquement (pas de
+# recherche de clés locales ni d'agent SSH) et pas d'échange de groupe DH SHA-1,
+# qui ajoute un aller-retour à la négociation
+_CONNECT_OPTIONS = {
+    "timeout": 10,
+    "banner_timeout": 10,
+    "look_for_keys": False,
+    "allow_agent": False,
+    "disabled_algorithms": {"kex": ["diffie-hellman-group-exchange-sha1"]},
+}
+
+# Script distant regroupant toutes les vérifications en une seule commande SSH.
+# Chaque bloc de sortie est précédé d'un marqueur ===SECTION=== ; le choix du
+# gestionnaire de paquets reprend l'ordre de détection de _detect_distribution.
+# Le cache APT n'est rafraîchi que si la variable apt_refresh est définie ;
+# le marqueur ===APT_REFRESHED=== n'est émis que si 'apt-get update' a réussi.
+# Le script est lu sur l'entrée standard du shell distant : le bloc { ... } est
+# analysé en entier avant d'être exécuté avec </dev/null, si bien qu'aucune
+# commande ne peut consommer la suite du script.
+_REMOTE_CHECK_SCRIPT = r"""
+{
+    os_info=$(cat /etc/os-release 2>/dev/null || cat /etc/redhat-release 2>/dev/null || echo 'unknown')
+    printf '===OSREL===\n%s\n' "$os_info"
+    case "$(printf '%s' "$os_info" | tr '[:upper:]' '[:lower:]')" in
+        *ubuntu*|*debian*)
+            if [ -n "$apt_refresh" ]; then
+                if sudo -n apt-get update >/dev/null 2>&1; then
+                    printf '===APT_REFRESHED===\n'
+                fi
+            fi
+            printf '===APT===\n'
+            apt list --upgradable 2>/dev/null
+            ;;
+        *centos*|*"red hat"*|*rhel*)
+            printf '===YUM===\n'
+            yum check-update 2>/dev/null | grep -E '^[a-zA-Z0-9]'
+            printf '===YUM_SECURITY===\n'
+            yum check-update --security 2>/dev/null | grep -E '^[a-zA-Z0-9]'
+            ;;
+        *fedora*)
+            printf '===DNF===\n'
+            dnf check-update 2>/dev/null | grep -E '^[a-zA-Z0-9]'
+            printf '===DNF_SECURITY===\n'
+            dnf check-update --security 2>/dev/null | grep -E '^[a-zA-Z0-9]'
+            ;;
+    esac
+    if command -v docker >/dev/null 2>&1; then
+        printf '===DOCKER===\n'
+        docker_out=$(docker ps --format '{{.Names}};;{{.Image}}' 2>&1)
+        case "$docker_out" in
+            *"ermission denied"*)
+                # sudo sans mot de passe : évite un second canal SSH ;
+                # sinon la sortie d'origine déclenche le repli sudo -S
+                sudo -n docker ps --format '{{.Names}};;{{.Image}}' 2>/dev/null \
+                    || printf '%s\n' "$docker_out"
+                ;;
+            *)
+                if [ -n "$docker_out" ]; then printf '%s\n' "$docker_out"; fi
+                ;;
+        esac
+    fi
+    printf '===DF===\n'
+    df -P 2>/dev/null
+} </dev/null
+"""
+
+# Shell distant lisant le script sur stdin, sans charger de fichiers de profil
+# (bash --noprofile --norc, ou sh si bash est absent)
+_REMOTE_SHELL = (
+    "if command -v bash >/dev/null 2>&1; then exec bash --noprofile --norc -s; "
+    "else exec sh -s; fi"
+)
+
+# Images Docker volontairement figées sur une version (jamais signalées)
+_IGNORE_DOCKER_IMAGES = frozenset({
+    "mongo:4.4.18",
+})
+
+# Gabarits HTML de l'email (templates/), compilés une seule fois : le cache de
+# bytecode évite de les recompiler à chaque exécution et auto_reload=False
+# supprime la vérification des dates de modification à chaque rendu
+_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+_EMAIL_ENV = Environment(
+    loader=FileSystemLoader(_TEMPLATE_DIR),
+    bytecode_cache=FileSystemBytecodeCache(pattern="smajs-%s.cache"),
+    autoescape=True,
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+)
+_HTML_TEMPLATE = _EMAIL_ENV.get_template("email.html.jinja")
+
+# Contenu minimal lorsqu'aucune machine n'a été vérifiée
+_EMPTY_TEXT = "SMAJS - Rapport de sécurité\n\nAucune machine vérifiée.\n"
+_EMPTY_HTML = (
+    "<html><body style=\"font-family:'Segoe UI', Tahoma, sans-serif;\">"
+    "<h1>SMAJS</h1><p>Aucune machine vérifiée.</p>"
+    "</body></html>"
+)
+
+# Ordre d'affichage des statuts, du plus grave au moins grave
+_SEVERITY_RANK = {
+    "critical": 0,
+    "security": 1,
+    "regular": 2,
+    "up-to-date": 3,
+    "error": 4,
+    "warning": 5,
+}
+
+# Dictionnaire vide partagé (lecture seule) pour les sections absentes d'un résultat
+_EMPTY = MappingProxyType({})
+
+# Libellés et couleurs des statuts, construits une seule fois
+_STATUS_MAP = {
+    "critical": "🚨 CRITIQUE",
+    "security": "⚠️  SÉCURITÉ",
+    "regular": "📄 RÉGULIER",
+    "up-to-date": "✅ À JOUR",
+    "error": "❌ ERREUR",
+    "warning": "⚠️  AVERTISSEMENT"
+}
+
+_STATUS_COLORS = {
+    "critical": "#FF4D4F",
+    "security": "#FAAD14",
+    "regular": "#1890FF",
+    "up-to-date": "#52C41A",
+}
+
+
+def _status_color(status: str) -> str:
+    return _STATUS_COLORS.get(status, "#8c8c8c")
+
+
+# Statistiques globales d'une exécution, calculées en un seul parcours des résultats
+Summary = namedtuple(
+    "Summary",
+    "successful critical security regular up_to_date docker docker_outdated disk_alert",
+)
+
+_SECTION_RE = re.compile(r"^===([A-Z_]+)===$", re.MULTILINE)
+
+
+def _split_sections(output: str) -> Dict[str, str]:
+    """
+    Découpe la sortie du script distant en {nom_section: contenu}
+    """
+    parts = _SECTION_RE.split(output)
+    return dict(zip(parts[1::2], parts[2::2]))
+
+
+def _parse_apt(block: str) -> Tuple[List[str], List[str]]:
+    """
+    Parse la sortie de 'apt list --upgradable' en (tous_les_paquets, paquets_sécurité).
+    Une seule liste est lue ; les paquets de sécurité sont ceux dont la ligne
+    mentionne 'security' (équivalent local de '| grep -i security').
+    """
+    all_packages = []
+    security_packages = []
+    for line in block.splitlines():
+        if '/' not in line:
+            continue
+        all_packages.append(line)
+        if 'security' in line.lower():
+            security_packages.append(line)
+    return all_packages, security_packages
+
+
+def _parse_check_update(block: str) -> List[str]:
+    """
+    Parse la sortie de 'yum/dnf check-update' en liste de noms de paquets
+    """
+    return [line.split()[0] for line in block.strip().split('\n') if line.strip()]
+
+
+def _parse_docker(block: str) -> Tuple[int, int, list]:
+    """
+    Parse la sortie 'nom;;image' en (nb_containers, nb_images, liste_images)
+    """
+    lines = [l for l in block.split("\n") if l.strip()]
+    containers = []
+    images = set()
+    for line in lines:
+        parts = line.split(";;")
+        if len(parts) != 2:
+            continue
+        cname, cimage = parts
+        cname = cname.strip()
+        cimage = cimage.strip()
+        if not cname and not cimage:
+            continue
+        containers.append((cname, cimage))
+        if cimage:
+            images.add(cimage)
+    return len(containers), len(images), sorted(images)
+
+
+def _parse_disk(block: str) -> List[Dict[str, Any]]:
+    """
+    Parse la sortie de 'df -P' en liste de partitions (hors tmpfs/devtmpfs)
+    """
+    partitions = []
+
+    # Première ligne = header
+    for line in block.strip().splitlines()[1:]:
+        # Au plus 5 découpes : un point de montage contenant des espaces
+        # reste intact dans le dernier champ
+        parts = line.split(None, 5)
+        # FS  1024-blocks  used  avail  capacity%  mountpoint
+        if len(parts) < 6:
+            continue
+
+        filesystem = parts[0]
+        pcent = parts[4]
+        mountpoint = parts[5]
+
+        if filesystem.startswith(("tmpfs", "devtmpfs")):
+            continue
+
+        try:
+            used_percent = int(pcent.rstrip("%"))
+        except ValueError:
+            continue
+
+        partitions.append({
+            "filesystem": filesystem,
+            "mountpoint": mountpoint,
+            "used_percent": used_percent
+        })
+
+    return partitions
+
+
+def _ssh_connect(ip: str, username: str, password: str, port: int = 22) -> paramiko.SSHClient:
+    """
+    Ouvre une connexion SSH par mot de passe (une par machine et par exécution)
+    """
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(_AUTO_POLICY)
+
+    try:
+        # Seule la phase de connexion est limitée, les commandes restent parallèles
+        with _CONNECT_SEMAPHORE:
+            ssh.connect(ip, port=port, username=username, password=password, **_CONNECT_OPTIONS)
+    except Exception:
+        ssh.close()
+        raise
+
+    return ssh
+
 
 class SMASJPro:
+    # Squelette commun des résultats d'une machine en erreur (voir _error_result)
+    _ERROR_TEMPLATE = {
+        "status": "error",
+        "distribution": "Inconnue",
+        "updates": {"total": 0, "critical": 0, "security": 0, "regular": 0},
+        "packages": {"critical": [], "security": [], "regular": []},
+        "docker": {
+            "has_docker": False,
+            "error": None,
+            "containers": 0,
+            "images_total": 0,
+            "images_outdated": 0,
+            "outdated_images": []
+        },
+        "disk": {"alert": False, "partitions": []}
+    }
+
     def __init__(self, config_file: str = "config.json", machines_file: str = "machines.json"):
         """
         Initialise le système SMAJS Pro
@@ -30,15 +318,47 @@ class SMASJPro:
         self.machines = self._load_machines(machines_file)
         self.results = {}
 
+        # Mots-clés des paquets critiques (minuscules, sans doublons) compilés en
+        # une seule alternative ("(?!)" ne correspond à rien si la liste est vide)
+        self._crit_kw = tuple(dict.fromkeys(
+            k.lower() for k in self.config["securite"]["paquets_critiques"]
+        ))
+        self._critical_re = re.compile(
+            "|".join(re.escape(k) for k in self._crit_kw) or "(?!)",
+            re.IGNORECASE
+        )
+
         # Paramètre global pour le seuil disque (par défaut 80 si non présent)
         self.disk_threshold = (
             self.config.get("disque", {}).get("seuil_alerte", 80)
         )
 
+        # Nombre maximal de machines vérifiées en parallèle
+        self.max_parallel = max(
+            1, self.config.get("verification", {}).get("max_parallele", 16)
+        )
+
         # Créer le dossier des rapports si nécessaire
         self.report_dir = self.config["rapports"]["dossier"]
         os.makedirs(self.report_dir, exist_ok=True)
 
+        # Rafraîchissement du cache APT (désactivé par défaut, sinon au plus
+        # une fois toutes les 'intervalle_heures' heures par machine)
+        apt_config = self.config.get("apt", {})
+        self.apt_refresh = apt_config.get("refresh", False)
+        self.apt_refresh_interval = apt_config.get("intervalle_heures", 24) * 3600
+        self.apt_refresh_file = os.path.join(self.report_dir, ".apt_refresh.json")
+        self.apt_refresh_times = self._load_apt_refresh() if self.apt_refresh else {}
+
+        self._set_run_started()
+
+    def _set_run_started(self):
+        """
+        Fige l'horodatage de l'exécution, réutilisé par le rapport et l'email
+        """
+        self._run_started = datetime.now()
+        self._run_started_fmt = self._run_started.strftime('%d/%m/%Y %H:%M:%S')
+
     def _load_config(self, config_file: str) -> Dict:
         """
         Charge la configuration depuis config.json
@@ -48,8 +368,8 @@ class SMASJPro:
             sys.exit(1)
 
         try:
-            with open(config_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(config_file, 'rb') as f:
+                return _jloads(f.read())
         except json.JSONDecodeError as e:
             print(f"❌ ERREUR: Fichier JSON invalide - {e}")
             sys.exit(1)
@@ -89,6 +409,13 @@ class SMASJPro:
             },
             "disque": {
                 "seuil_alerte": 80  # en %, au-delà de ce seuil d'utilisation -> alerte
+            },
+            "apt": {
+                "refresh": False,  # lancer 'apt-get update' avant la vérification
+                "intervalle_heures": 24  # délai minimal entre deux rafraîchissements
+            },
+            "verification": {
+                "max_parallele": 16  # nombre maximal de machines vérifiées simultanément
             }
         }
 
@@ -107,32 +434,93 @@ class SMASJPro:
             sys.exit(1)
 
         try:
-            with open(machines_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get("machines", [])
+            with open(machines_file, 'rb') as f:
+                data = _jloads(f.read())
+            return data.get("machines", [])
         except Exception as e:
             print(f"❌ Erreur lors du chargement des machines: {e}")
             sys.exit(1)
 
-    def _clean_old_reports(self):
+    def _load_apt_refresh(self) -> Dict[str, float]:
+        """
+        Charge les dates du dernier rafraîchissement APT de chaque machine
+        """
+        try:
+            with open(self.apt_refresh_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_apt_refresh(self):
+        """
+        Sauvegarde les dates du dernier rafraîchissement APT de chaque machine
+        """
+        try:
+            with open(self.apt_refresh_file, 'w', encoding='utf-8') as f:
+                json.dump(self.apt_refresh_times, f, indent=2, ensure_ascii=False)
+        except OSError as e:
+            print(f"⚠️  Impossible d'enregistrer {self.apt_refresh_file}: {e}")
+
+    def _apt_refresh_due(self, name: str) -> bool:
+        """
+        Indique si le cache APT de la machine doit être rafraîchi
+        """
+        if not self.apt_refresh:
+            return False
+        last_refresh = self.apt_refresh_times.get(name, 0)
+        return time.time() - last_refresh >= self.apt_refresh_interval
+
+    def _clean_old_reports(self, keep: str | None = None):
         """
         Nettoie les anciens rapports pour ne garder que les X plus récents
+        (et, si 'retention_jours' est défini, aucun rapport plus ancien).
+        Le rapport 'keep' (celui de l'exécution en cours) n'est jamais supprimé.
         """
         max_files = self.config["rapports"]["max_files"]
-        pattern = os.path.join(self.report_dir, "rapport_smajs_*.txt")
-        files = glob.glob(pattern)
-
-        if len(files) > max_files:
-            # Trier par date de modification (du plus ancien au plus récent)
-            files.sort(key=os.path.getmtime)
+        retention_days = self.config["rapports"].get("retention_jours")
+        max_age = None
+        if retention_days is not None:
+            if isinstance(retention_days, (int, float)) and not isinstance(retention_days, bool) and retention_days > 0:
+                max_age = retention_days * 86400
+            else:
+                print(f"⚠️  'retention_jours' invalide ({retention_days!r}), rétention par âge ignorée")
+        keep = os.path.abspath(keep) if keep else None
+        now = time.time()
+
+        expired = []
+        entries = []
+        n_kept = 0
+        # scandir met en cache le stat de chaque entrée (un seul appel système)
+        with os.scandir(self.report_dir) as it:
+            for e in it:
+                name = e.name
+                if not (name.startswith("rapport_smajs_") and name.endswith(".txt")):
+                    continue
+                if not e.is_file():
+                    continue
+                if keep is not None and os.path.abspath(e.path) == keep:
+                    # Compte pour max_files mais n'est jamais candidat à la suppression
+                    n_kept = 1
+                    continue
+                if max_age is not None and now - e.stat().st_mtime > max_age:
+                    expired.append(e)
+                else:
+                    entries.append(e)
+
+        # max_files = 0 désactive la limite (comme l'ancien files[:-max_files])
+        n_remove = len(entries) + n_kept - max_files
+        if max_files > 0 and n_remove > 0:
+            # Seuls les plus anciens sont extraits, sans trier toute la liste
+            expired.extend(
+                heapq.nsmallest(n_remove, entries, key=lambda e: e.stat().st_mtime)
+            )
 
-            # Supprimer les plus anciens
-            for file in files[:-max_files]:
-                try:
-                    os.remove(file)
-                    print(f"🗑️  Supprimé: {os.path.basename(file)}")
-                except Exception as e:
-                    print(f"⚠️  Impossible de supprimer {file}: {e}")
+        for entry in expired:
+            try:
+                os.remove(entry.path)
+                print(f"🗑️  Supprimé: {entry.name}")
+            except Exception as e:
+                print(f"⚠️  Impossible de supprimer {entry.path}: {e}")
 
     def _get_credentials(self, machine: Dict) -> Tuple[str, str]:
         """
@@ -146,9 +534,45 @@ class SMASJPro:
 
         return username, password
 
-    def _check_docker(self, ssh, password: str | None) -> Dict[str, Any]:
+    def _run(self, ssh, cmd: str, stdin_data: str | None = None, want_stderr: bool = False):
+        """
+        Exécute une commande sur un canal SSH dédié et retourne sa sortie décodée.
+        'stdin_data' est envoyé sur l'entrée standard (ex: mot de passe sudo).
+        Retourne (stdout, stderr) si want_stderr, sinon stdout seul.
+        """
+        chan = ssh.get_transport().open_session(timeout=10)
+        try:
+            chan.exec_command(cmd)
+            if stdin_data is not None:
+                chan.sendall(stdin_data.encode())
+            chan.shutdown_write()
+
+            # stdout et stderr sont vidés ensemble : un stderr non lu finirait par
+            # remplir la fenêtre SSH et bloquer la commande distante
+            out = bytearray()
+            err = bytearray()
+            while True:
+                select.select([chan], [], [], 1.0)
+                while chan.recv_ready():
+                    out += chan.recv(65536)
+                while chan.recv_stderr_ready():
+                    err += chan.recv_stderr(65536)
+                # exit-status peut arriver avant les dernières données :
+                # on lit jusqu'à la fin de flux (EOF), pas seulement jusqu'au code retour
+                if (chan.eof_received or chan.closed) and not chan.recv_ready() and not chan.recv_stderr_ready():
+                    break
+            chan.recv_exit_status()
+
+            if want_stderr:
+                return out.decode(), err.decode()
+            return out.decode()
+        finally:
+            chan.close()
+
+    def _check_docker(self, ssh, password: str | None, output: str | None) -> Dict[str, Any]:
         """
         Vérifie la présence de Docker et donne une info très légère sur les images.
+        'output' est la section DOCKER du script distant (None si docker absent).
         """
         result = {
             "has_docker": False,
@@ -159,52 +583,24 @@ class SMASJPro:
             "outdated_images": [],
         }
 
-        def parse_docker_ps_output(raw: str) -> Tuple[int, int, list]:
-            """Parse la sortie 'nom;;image' en (nb_containers, nb_images, liste_images)."""
-            lines = [l for l in raw.split("\n") if l.strip()]
-            containers = []
-            images = set()
-            for line in lines:
-                parts = line.split(";;")
-                if len(parts) != 2:
-                    continue
-                cname, cimage = parts
-                cname = cname.strip()
-                cimage = cimage.strip()
-                if not cname and not cimage:
-                    continue
-                containers.append((cname, cimage))
-                if cimage:
-                    images.add(cimage)
-            return len(containers), len(images), sorted(images)
-
-        try:
-            # 1) Vérifier si docker est installé
-            stdin, stdout, stderr = ssh.exec_command(
-                "command -v docker >/dev/null 2>&1 && echo 'yes' || echo 'no'"
-            )
-            has_docker_raw = stdout.read().decode().strip()
+        if output is None:
+            return result  # pas de docker installé
 
-            if has_docker_raw != "yes":
-                return result  # pas de docker installé
+        result["has_docker"] = True
 
-            result["has_docker"] = True
-
-            # 2) Essayer docker ps sans sudo
-            cmd = "docker ps --format '{{.Names}};;{{.Image}}' 2>&1"
-            stdin, stdout, stderr = ssh.exec_command(cmd)
-            out = stdout.read().decode()
-            err = stderr.read().decode()
-            combined = (out + "\n" + err).lower()
+        try:
+            # 1) Sortie de docker ps sans sudo, déjà récupérée par le script distant
+            out = output
+            combined = out.lower()
 
             need_sudo = "permission denied" in combined or "got permission denied" in combined
 
             if not need_sudo and ("cannot connect to the docker daemon" in combined and "permission denied" not in combined):
-                result["error"] = (out + "\n" + err).strip() or "Erreur lors de l'accès à Docker (daemon indisponible)."
+                result["error"] = out.strip() or "Erreur lors de l'accès à Docker (daemon indisponible)."
                 return result
 
             if not need_sudo and out.strip():
-                containers, nb_images, images = parse_docker_ps_output(out)
+                containers, nb_images, images = _parse_docker(out)
                 result["containers"] = containers
                 result["images_total"] = nb_images
             elif need_sudo:
@@ -212,13 +608,9 @@ class SMASJPro:
                     result["error"] = "Permission refusée pour Docker et aucun mot de passe sudo disponible."
                     return result
 
+                # 2) Relancer docker ps avec sudo (mot de passe transmis sur stdin)
                 sudo_cmd = "sudo -S -p '' docker ps --format '{{.Names}};;{{.Image}}' 2>&1"
-                stdin, stdout, stderr = ssh.exec_command(sudo_cmd)
-                stdin.write(password + "\n")
-                stdin.flush()
-
-                out_sudo = stdout.read().decode()
-                err_sudo = stderr.read().decode()
+                out_sudo, err_sudo = self._run(ssh, sudo_cmd, stdin_data=password + "\n", want_stderr=True)
                 combined_sudo = (out_sudo + "\n" + err_sudo).lower()
 
                 if "permission denied" in combined_sudo or "authentication failure" in combined_sudo:
@@ -230,7 +622,7 @@ class SMASJPro:
                     return result
 
                 if out_sudo.strip():
-                    containers, nb_images, images = parse_docker_ps_output(out_sudo)
+                    containers, nb_images, images = _parse_docker(out_sudo)
                     result["containers"] = containers
                     result["images_total"] = nb_images
                 else:
@@ -241,39 +633,20 @@ class SMASJPro:
             if result["images_total"] == 0:
                 return result
 
-            images_set = set()
-
-            if need_sudo:
-                sudo_cmd2 = "sudo -S -p '' docker ps --format '{{.Image}}'"
-                stdin2, stdout2, stderr2 = ssh.exec_command(sudo_cmd2)
-                stdin2.write(password + "\n")
-                stdin2.flush()
-                imgs_raw = stdout2.read().decode().strip().split("\n")
-            else:
-                stdin2, stdout2, stderr2 = ssh.exec_command("docker ps --format '{{.Image}}'")
-                imgs_raw = stdout2.read().decode().strip().split("\n")
-
-            for img in imgs_raw:
-                img = img.strip()
-                if img:
-                    images_set.add(img)
+            # Les images sont déjà connues grâce au premier 'docker ps'
+            images_set = set(images)
 
             if not images_set:
                 return result
 
-            IGNORE_DOCKER_IMAGES = {
-                "mongo:4.4.18",
-            }
-
             outdated = []
             for img in images_set:
-                if img in IGNORE_DOCKER_IMAGES:
+                if img in _IGNORE_DOCKER_IMAGES:
                     continue
 
-                if ":" in img:
-                    repo, tag = img.rsplit(":", 1)
-                else:
-                    repo, tag = img, "latest"
+                repo, sep, tag = img.rpartition(":")
+                if not sep:
+                    tag = "latest"
 
                 if tag != "latest":
                     outdated.append(img)
@@ -286,9 +659,9 @@ class SMASJPro:
 
         return result
 
-    def _check_disk(self, ssh, threshold: int = None) -> Dict[str, Any]:
+    def _check_disk(self, output: str, threshold: int = None) -> Dict[str, Any]:
         """
-        Vérifie l'utilisation disque.
+        Vérifie l'utilisation disque à partir de la section DF du script distant.
         Alerte si une partition dépasse 'threshold' % d'utilisation.
         Si threshold est None, utilise self.disk_threshold.
         """
@@ -303,52 +676,35 @@ class SMASJPro:
         }
 
         try:
-            cmd = "df -P -h 2>/dev/null"
-            stdin, stdout, stderr = ssh.exec_command(cmd)
-            output = stdout.read().decode().strip()
-            err = stderr.read().decode().strip()
+            output = output.strip()
 
             if not output:
-                result["error"] = err or "Aucune sortie de 'df'."
+                result["error"] = "Aucune sortie de 'df'."
                 return result
 
-            lines = output.splitlines()
-            if len(lines) <= 1:
+            if len(output.splitlines()) <= 1:
                 result["error"] = "Sortie de 'df' invalide ou incomplète."
                 return result
 
-            # Première ligne = header
-            for line in lines[1:]:
-                parts = line.split()
-                # FS  size  used  avail  use%  mountpoint
-                if len(parts) < 6:
-                    continue
-
-                filesystem = parts[0]
-                pcent = parts[4]
-                mountpoint = parts[5]
-
-                if filesystem.startswith("tmpfs") or filesystem.startswith("devtmpfs"):
-                    continue
-
-                try:
-                    used_percent = int(pcent.strip().replace("%", ""))
-                except ValueError:
-                    continue
-
-                if used_percent >= threshold:
+            for part in _parse_disk(output):
+                if part["used_percent"] >= threshold:
                     result["alert"] = True
-                    result["partitions"].append({
-                        "filesystem": filesystem,
-                        "mountpoint": mountpoint,
-                        "used_percent": used_percent
-                    })
+                    result["partitions"].append(part)
 
         except Exception as e:
             result["error"] = str(e)
 
         return result
 
+    def _error_result(self, name: str, ip: str, error: str, disk_error: str) -> Dict[str, Any]:
+        """
+        Construit le résultat d'une machine dont la vérification a échoué
+        """
+        result = {"name": name, "ip": ip, "error": error, **copy.deepcopy(self._ERROR_TEMPLATE)}
+        result["disk"]["threshold"] = self.disk_threshold
+        result["disk"]["error"] = disk_error
+        return result
+
     def _check_machine(self, machine: Dict) -> Dict[str, Any]:
         """
         Vérifie une machine et retourne les résultats
@@ -359,54 +715,53 @@ class SMASJPro:
         username, password = self._get_credentials(machine)
 
         if not username or not password:
-            return {
-                "name": name,
-                "ip": ip,
-                "status": "error",
-                "error": "Identifiants manquants",
-                "distribution": "Inconnue",
-                "updates": {
-                    "total": 0,
-                    "critical": 0,
-                    "security": 0,
-                    "regular": 0
-                },
-                "packages": {
-                    "critical": [],
-                    "security": [],
-                    "regular": []
-                },
-                "docker": {
-                    "has_docker": False,
-                    "error": None,
-                    "containers": 0,
-                    "images_total": 0,
-                    "images_outdated": 0,
-                    "outdated_images": []
-                },
-                "disk": {
-                    "alert": False,
-                    "threshold": self.disk_threshold,
-                    "partitions": [],
-                    "error": "Vérification impossible (identifiants manquants)."
-                }
-            }
+            return self._error_result(
+                name, ip, "Identifiants manquants",
+                "Vérification impossible (identifiants manquants)."
+            )
 
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        port = machine.get("port", 22)
 
+        # Test TCP rapide : une machine injoignable est écartée en ~1 s au lieu
+        # d'occuper un thread jusqu'aux timeouts de paramiko
         try:
-            ssh.connect(ip, username=username, password=password,
-                       timeout=10, banner_timeout=10)
+            socket.create_connection((ip, port), timeout=1.5).close()
+        except OSError:
+            return self._error_result(
+                name, ip, f"Port {port} injoignable",
+                "Vérification impossible (machine injoignable)."
+            )
+
+        ssh = None
+        try:
+            ssh = _ssh_connect(ip, username, password, port)
+
+            refresh_apt = self._apt_refresh_due(name)
+            script = _REMOTE_CHECK_SCRIPT
+            if refresh_apt:
+                script = "apt_refresh=1\n" + script
 
-            distro = self._detect_distribution(ssh)
+            # Une seule commande SSH pour l'ensemble des vérifications
+            sections = _split_sections(self._run(ssh, _REMOTE_SHELL, stdin_data=script))
+
+            distro = self._detect_distribution(sections.get("OSREL", ""))
 
             if distro in ["ubuntu", "debian"]:
-                base_result = self._check_apt(ssh, name, ip, distro)
+                if refresh_apt:
+                    # Horodatage enregistré uniquement si 'apt-get update' a réussi
+                    if "APT_REFRESHED" in sections:
+                        self.apt_refresh_times[name] = time.time()
+                    else:
+                        print(f"⚠️  {name}: rafraîchissement APT impossible (sudo -n apt-get update a échoué)")
+                base_result = self._check_apt(name, ip, distro, sections.get("APT", ""))
             elif distro in ["centos", "rhel"]:
-                base_result = self._check_yum(ssh, name, ip, distro)
+                base_result = self._check_yum(
+                    name, ip, distro, sections.get("YUM", ""), sections.get("YUM_SECURITY", "")
+                )
             elif distro == "fedora":
-                base_result = self._check_dnf(ssh, name, ip, distro)
+                base_result = self._check_dnf(
+                    name, ip, distro, sections.get("DNF", ""), sections.get("DNF_SECURITY", "")
+                )
             else:
                 base_result = {
                     "name": name,
@@ -418,73 +773,33 @@ class SMASJPro:
                     "packages": {"critical": [], "security": [], "regular": []}
                 }
 
-            docker_info = self._check_docker(ssh, password)
+            docker_info = self._check_docker(ssh, password, sections.get("DOCKER"))
             base_result["docker"] = docker_info
 
-            disk_info = self._check_disk(ssh, threshold=self.disk_threshold)
+            disk_info = self._check_disk(sections.get("DF", ""), threshold=self.disk_threshold)
             base_result["disk"] = disk_info
 
             return base_result
 
         except paramiko.AuthenticationException:
-            return {
-                "name": name,
-                "ip": ip,
-                "status": "error",
-                "error": "Échec d'authentification SSH",
-                "distribution": "Inconnue",
-                "updates": {"total": 0, "critical": 0, "security": 0, "regular": 0},
-                "packages": {"critical": [], "security": [], "regular": []},
-                "docker": {
-                    "has_docker": False,
-                    "error": None,
-                    "containers": 0,
-                    "images_total": 0,
-                    "images_outdated": 0,
-                    "outdated_images": []
-                },
-                "disk": {
-                    "alert": False,
-                    "threshold": self.disk_threshold,
-                    "partitions": [],
-                    "error": "Vérification impossible (authentification SSH échouée)."
-                }
-            }
+            return self._error_result(
+                name, ip, "Échec d'authentification SSH",
+                "Vérification impossible (authentification SSH échouée)."
+            )
         except Exception as e:
-            return {
-                "name": name,
-                "ip": ip,
-                "status": "error",
-                "error": str(e),
-                "distribution": "Inconnue",
-                "updates": {"total": 0, "critical": 0, "security": 0, "regular": 0},
-                "packages": {"critical": [], "security": [], "regular": []},
-                "docker": {
-                    "has_docker": False,
-                    "error": None,
-                    "containers": 0,
-                    "images_total": 0,
-                    "images_outdated": 0,
-                    "outdated_images": []
-                },
-                "disk": {
-                    "alert": False,
-                    "threshold": self.disk_threshold,
-                    "partitions": [],
-                    "error": "Vérification disque non effectuée (erreur générale)."
-                }
-            }
+            return self._error_result(
+                name, ip, str(e),
+                "Vérification disque non effectuée (erreur générale)."
+            )
         finally:
-            ssh.close()
+            if ssh is not None:
+                ssh.close()
 
-    def _detect_distribution(self, ssh) -> str:
+    def _detect_distribution(self, os_info: str) -> str:
         """
-        Détecte la distribution Linux
+        Détecte la distribution Linux à partir du contenu de /etc/os-release
         """
-        stdin, stdout, stderr = ssh.exec_command(
-            "cat /etc/os-release 2>/dev/null || cat /etc/redhat-release 2>/dev/null || echo 'unknown'"
-        )
-        os_info = stdout.read().decode().lower()
+        os_info = os_info.lower()
 
         if "ubuntu" in os_info:
             return "ubuntu"
@@ -501,37 +816,26 @@ class SMASJPro:
         else:
             return "unknown"
 
-    def _check_apt(self, ssh, name: str, ip: str, distro: str) -> Dict[str, Any]:
+    def _check_apt(self, name: str, ip: str, distro: str, output: str) -> Dict[str, Any]:
         """
         Vérifie les mises à jour APT (Debian/Ubuntu)
         """
         try:
-            ssh.exec_command("sudo apt-get update 2>&1")
-            time.sleep(1)
-
-            stdin, stdout, stderr = ssh.exec_command("apt list --upgradable 2>/dev/null")
-            all_updates = stdout.read().decode().strip().split('\n')
-            all_packages = [line for line in all_updates if '/' in line]
-
-            stdin, stdout, stderr = ssh.exec_command("apt list --upgradable 2>/dev/null | grep -i security")
-            security_updates = stdout.read().decode().strip().split('\n')
-            security_packages = [line for line in security_updates if '/' in line]
-
-            critical_packages = []
-            critical_keywords = self.config["securite"]["paquets_critiques"]
+            all_packages, security_packages = _parse_apt(output)
 
-            for package in security_packages:
-                pkg_name = package.split('/')[0].lower()
-                if any(keyword in pkg_name for keyword in critical_keywords):
-                    critical_packages.append(package.split('/')[0])
+            security_pkg_names = [pkg.split('/', 1)[0] for pkg in security_packages]
+            is_critical = self._critical_re.search
+            critical_packages = [pkg for pkg in security_pkg_names if is_critical(pkg)]
 
-            security_pkg_names = [pkg.split('/')[0] for pkg in security_packages]
+            security_pkg_set = set(security_pkg_names)
             regular_packages = []
             for package in all_packages:
-                pkg_name = package.split('/')[0]
-                if pkg_name not in security_pkg_names:
+                pkg_name = package.split('/', 1)[0]
+                if pkg_name not in security_pkg_set:
                     regular_packages.append(pkg_name)
 
+            critical_set = set(critical_packages)
+
             if critical_packages:
                 status = "critical"
             elif security_packages:
@@ -555,7 +859,7 @@ class SMASJPro:
                 },
                 "packages": {
                     "critical": critical_packages,
-                    "security": [pkg.split('/')[0] for pkg in security_packages if pkg.split('/')[0] not in critical_packages],
+                    "security": [pkg for pkg in security_pkg_names if pkg not in critical_set],
                     "regular": regular_packages
                 }
             }
@@ -571,28 +875,20 @@ class SMASJPro:
                 "packages": {"critical": [], "security": [], "regular": []}
             }
 
-    def _check_dnf(self, ssh, name: str, ip: str, distro: str) -> Dict[str, Any]:
+    def _check_dnf(self, name: str, ip: str, distro: str, output: str, security_output: str) -> Dict[str, Any]:
         """
         Vérifie les mises à jour DNF (Fedora)
         """
         try:
-            stdin, stdout, stderr = ssh.exec_command("dnf check-update 2>/dev/null | grep -E '^[a-zA-Z0-9]'")
-            all_updates = stdout.read().decode().strip().split('\n')
-            all_packages = [line.split()[0] for line in all_updates if line]
-
-            stdin, stdout, stderr = ssh.exec_command("dnf check-update --security 2>/dev/null | grep -E '^[a-zA-Z0-9]'")
-            security_updates = stdout.read().decode().strip().split('\n')
-            security_packages = [line.split()[0] for line in security_updates if line]
+            all_packages = _parse_check_update(output)
+            security_packages = _parse_check_update(security_output)
 
-            critical_packages = []
-            critical_keywords = self.config["securite"]["paquets_critiques"]
+            is_critical = self._critical_re.search
+            critical_packages = [pkg for pkg in security_packages if is_critical(pkg)]
 
-            for package in security_packages:
-                pkg_name = package.lower()
-                if any(keyword in pkg_name for keyword in critical_keywords):
-                    critical_packages.append(package)
-
-            regular_packages = [pkg for pkg in all_packages if pkg not in security_packages]
+            security_set = set(security_packages)
+            regular_packages = [pkg for pkg in all_packages if pkg not in security_set]
+            critical_set = set(critical_packages)
 
             if critical_packages:
                 status = "critical"
@@ -617,7 +913,7 @@ class SMASJPro:
                 },
                 "packages": {
                     "critical": critical_packages,
-                    "security": [pkg for pkg in security_packages if pkg not in critical_packages],
+                    "security": [pkg for pkg in security_packages if pkg not in critical_set],
                     "regular": regular_packages
                 }
             }
@@ -633,28 +929,20 @@ class SMASJPro:
                 "packages": {"critical": [], "security": [], "regular": []}
             }
 
-    def _check_yum(self, ssh, name: str, ip: str, distro: str) -> Dict[str, Any]:
+    def _check_yum(self, name: str, ip: str, distro: str, output: str, security_output: str) -> Dict[str, Any]:
         """
         Vérifie les mises à jour YUM (CentOS/RHEL)
         """
         try:
-            stdin, stdout, stderr = ssh.exec_command("yum check-update 2>/dev/null | grep -E '^[a-zA-Z0-9]'")
-            all_updates = stdout.read().decode().strip().split('\n')
-            all_packages = [line.split()[0] for line in all_updates if line]
-
-            stdin, stdout, stderr = ssh.exec_command("yum check-update --security 2>/dev/null | grep -E '^[a-zA-Z0-9]'")
-            security_updates = stdout.read().decode().strip().split('\n')
-            security_packages = [line.split()[0] for line in security_updates if line]
+            all_packages = _parse_check_update(output)
+            security_packages = _parse_check_update(security_output)
 
-            critical_packages = []
-            critical_keywords = self.config["securite"]["paquets_critiques"]
+            is_critical = self._critical_re.search
+            critical_packages = [pkg for pkg in security_packages if is_critical(pkg)]
 
-            for package in security_packages:
-                pkg_name = package.lower()
-                if any(keyword in pkg_name for keyword in critical_keywords):
-                    critical_packages.append(package)
-
-            regular_packages = [pkg for pkg in all_packages if pkg not in security_packages]
+            security_set = set(security_packages)
+            regular_packages = [pkg for pkg in all_packages if pkg not in security_set]
+            critical_set = set(critical_packages)
 
             if critical_packages:
                 status = "critical"
@@ -679,7 +967,7 @@ class SMASJPro:
                 },
                 "packages": {
                     "critical": critical_packages,
-                    "security": [pkg for pkg in security_packages if pkg not in critical_packages],
+                    "security": [pkg for pkg in security_packages if pkg not in critical_set],
                     "regular": regular_packages
                 }
             }
@@ -695,582 +983,421 @@ class SMASJPro:
                 "packages": {"critical": [], "security": [], "regular": []}
             }
 
-    def _generate_report(self) -> str:
+    def _generate_report(self, summary: Summary = None, ordered: List = None) -> str:
         """
         Génère un rapport détaillé et le sauvegarde
         """
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if ordered is None:
+            ordered = self._sort_results()
+        disk_threshold = self.disk_threshold
+        timestamp = self._run_started.strftime('%Y%m%d_%H%M%S')
         report_file = os.path.join(self.report_dir, f"rapport_smajs_{timestamp}.txt")
 
-        with open(report_file, 'w', encoding='utf-8') as f:
-            f.write("=" * 80 + "\n")
-            f.write("SMAJS - RAPPORT DE SÉCURITÉ\n")
-            f.write(f"Date: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
-            f.write("=" * 80 + "\n\n")
+        parts = []
+        parts.append("=" * 80 + "\n")
+        parts.append("SMAJS - RAPPORT DE SÉCURITÉ\n")
+        parts.append(f"Date: {self._run_started_fmt}\n")
+        parts.append("=" * 80 + "\n\n")
 
-            total_machines = len(self.machines)
-            successful_checks = sum(1 for r in self.results.values() if r["status"] != "error")
-            critical_machines = sum(1 for r in self.results.values() if r["status"] == "critical")
-            security_machines = sum(1 for r in self.results.values() if r["status"] == "security")
+        total_machines = len(self.machines)
 
-            docker_machines = sum(
-                1 for r in self.results.values()
-                if r.get("docker", {}).get("has_docker")
-            )
-            docker_machines_outdated = sum(
-                1 for r in self.results.values()
-                if r.get("docker", {}).get("has_docker") and r["docker"].get("images_outdated", 0) > 0
-            )
-            disk_alert_machines = sum(
-                1 for r in self.results.values()
-                if r.get("disk", {}).get("alert")
-            )
+        if summary is None:
+            summary = self._summarize()
+        successful_checks = summary.successful
+        critical_machines = summary.critical
+        security_machines = summary.security
+        docker_machines = summary.docker
+        docker_machines_outdated = summary.docker_outdated
+        disk_alert_machines = summary.disk_alert
+
+        parts.append("📊 STATISTIQUES GLOBALES\n")
+        parts.append("-" * 40 + "\n")
+        parts.append(f"Machines vérifiées: {total_machines}\n")
+        parts.append(f"Vérifications réussies: {successful_checks}\n")
+        parts.append(f"Machines critiques: {critical_machines}\n")
+        parts.append(f"Machines avec mises à jour de sécurité: {security_machines}\n")
+        parts.append(f"Machines avec Docker: {docker_machines}\n")
+        parts.append(f"Machines avec images Docker potentiellement à mettre à jour: {docker_machines_outdated}\n")
+        parts.append(f"Machines avec alerte disque (>={disk_threshold}% utilisé): {disk_alert_machines}\n\n")
+
+        for name, result in ordered:
+            parts.append(f"🔧 {name} ({result['ip']})\n")
+            parts.append(f"   Distribution: {result['distribution']}\n")
+            parts.append(f"   Statut: {self._get_status_text(result['status'])}\n")
 
-            f.write("📊 STATISTIQUES GLOBALES\n")
-            f.write("-" * 40 + "\n")
-            f.write(f"Machines vérifiées: {total_machines}\n")
-            f.write(f"Vérifications réussies: {successful_checks}\n")
-            f.write(f"Machines critiques: {critical_machines}\n")
-            f.write(f"Machines avec mises à jour de sécurité: {security_machines}\n")
-            f.write(f"Machines avec Docker: {docker_machines}\n")
-            f.write(f"Machines avec images Docker potentiellement à mettre à jour: {docker_machines_outdated}\n")
-            f.write(f"Machines avec alerte disque (>={self.disk_threshold}% utilisé): {disk_alert_machines}\n\n")
-
-            for name, result in self.results.items():
-                f.write(f"🔧 {name} ({result['ip']})\n")
-                f.write(f"   Distribution: {result['distribution']}\n")
-                f.write(f"   Statut: {self._get_status_text(result['status'])}\n")
-
-                if result["error"]:
-                    f.write(f"   Erreur: {result['error']}\n")
+            if result["error"]:
+                parts.append(f"   Erreur: {result['error']}\n")
+            else:
+                updates = result["updates"]
+                parts.append(f"   Total mises à jour: {updates['total']}\n")
+                parts.append(f"   Mises à jour critiques: {updates['critical']}\n")
+                parts.append(f"   Mises à jour de sécurité: {updates['security']}\n")
+                parts.append(f"   Mises à jour régulières: {updates['regular']}\n")
+
+                if updates['critical'] > 0:
+                    parts.append("   Paquets critiques:\n")
+                    for pkg in result["packages"]["critical"][:5]:
+                        parts.append(f"     • {pkg}\n")
+                    if updates['critical'] > 5:
+                        parts.append(f"     ... et {updates['critical'] - 5} autres\n")
+
+            docker_info = result.get("docker") or _EMPTY
+            if docker_info.get("has_docker"):
+                parts.append("   🐳 Docker:\n")
+                parts.append(f"     • Conteneurs en cours: {docker_info.get('containers', 0)}\n")
+                parts.append(f"     • Images utilisées: {docker_info.get('images_total', 0)}\n")
+                if docker_info.get("images_outdated", 0) > 0:
+                    parts.append(f"     • Images potentiellement à mettre à jour: {docker_info['images_outdated']}\n")
+                    for img in docker_info.get("outdated_images", [])[:5]:
+                        parts.append(f"       - {img}\n")
+                    if docker_info["images_outdated"] > 5:
+                        parts.append(f"       ... et {docker_info['images_outdated'] - 5} autres\n")
                 else:
-                    updates = result["updates"]
-                    f.write(f"   Total mises à jour: {updates['total']}\n")
-                    f.write(f"   Mises à jour critiques: {updates['critical']}\n")
-                    f.write(f"   Mises à jour de sécurité: {updates['security']}\n")
-                    f.write(f"   Mises à jour régulières: {updates['regular']}\n")
-
-                    if updates['critical'] > 0:
-                        f.write("   Paquets critiques:\n")
-                        for pkg in result["packages"]["critical"][:5]:
-                            f.write(f"     • {pkg}\n")
-                        if updates['critical'] > 5:
-                            f.write(f"     ... et {updates['critical'] - 5} autres\n")
-
-                docker_info = result.get("docker", {})
-                if docker_info.get("has_docker"):
-                    f.write("   🐳 Docker:\n")
-                    f.write(f"     • Conteneurs en cours: {docker_info.get('containers', 0)}\n")
-                    f.write(f"     • Images utilisées: {docker_info.get('images_total', 0)}\n")
-                    if docker_info.get("images_outdated", 0) > 0:
-                        f.write(f"     • Images potentiellement à mettre à jour: {docker_info['images_outdated']}\n")
-                        for img in docker_info.get("outdated_images", [])[:5]:
-                            f.write(f"       - {img}\n")
-                        if docker_info["images_outdated"] > 5:
-                            f.write(f"       ... et {docker_info['images_outdated'] - 5} autres\n")
-                    else:
-                        f.write("     • Aucune image Docker nécessitant une attention particulière détectée (info indicative).\n")
-                elif docker_info.get("error"):
-                    f.write(f"   🐳 Docker: erreur lors de la vérification ({docker_info['error']})\n")
+                    parts.append("     • Aucune image Docker nécessitant une attention particulière détectée (info indicative).\n")
+            elif docker_info.get("error"):
+                parts.append(f"   🐳 Docker: erreur lors de la vérification ({docker_info['error']})\n")
 
-                disk_info = result.get("disk", {})
-                if disk_info.get("alert"):
-                    f.write("   💽 Alerte disque (>= {0}% utilisé):\n".format(disk_info.get("threshold", self.disk_threshold)))
-                    for part in disk_info.get("partitions", []):
-                        f.write(
-                            "     • {fs} monté sur {mp} : {used}% utilisé\n".format(
-                                fs=part["filesystem"],
-                                mp=part["mountpoint"],
-                                used=part["used_percent"],
-                            )
+            disk_info = result.get("disk") or _EMPTY
+            if disk_info.get("alert"):
+                parts.append("   💽 Alerte disque (>= {0}% utilisé):\n".format(disk_info.get("threshold", disk_threshold)))
+                for part in disk_info.get("partitions", []):
+                    parts.append(
+                        "     • {fs} monté sur {mp} : {used}% utilisé\n".format(
+                            fs=part["filesystem"],
+                            mp=part["mountpoint"],
+                            used=part["used_percent"],
                         )
-                elif disk_info.get("error"):
-                    f.write(f"   💽 Disque: erreur lors de la vérification ({disk_info['error']})\n")
-
-                f.write("\n")
-
-            f.write("💡 RECOMMANDATIONS\n")
-            f.write("-" * 40 + "\n")
-
-            if critical_machines > 0:
-                f.write("🚨 ACTION IMMÉDIATE REQUISE:\n")
-                f.write("   • Mettre à jour les paquets critiques IMMÉDIATEMENT\n")
-                f.write("   • Vérifier les logs système après mise à jour\n")
-                f.write("   • Redémarrer si nécessaire\n")
-            elif security_machines > 0:
-                f.write("⚠️  ACTION RECOMMANDÉE:\n")
-                f.write("   • Planifier les mises à jour de sécurité\n")
-                f.write("   • Appliquer les correctifs lors de la prochaine maintenance\n")
-            else:
-                f.write("✅ SYSTÈME STABLE:\n")
-                f.write("   • Continuer la surveillance régulière\n")
-                f.write("   • Maintenir les bonnes pratiques de sécurité\n")
+                    )
+            elif disk_info.get("error"):
+                parts.append(f"   💽 Disque: erreur lors de la vérification ({disk_info['error']})\n")
+
+            parts.append("\n")
+
+        parts.append("💡 RECOMMANDATIONS\n")
+        parts.append("-" * 40 + "\n")
+
+        if critical_machines > 0:
+            parts.append("🚨 ACTION IMMÉDIATE REQUISE:\n")
+            parts.append("   • Mettre à jour les paquets critiques IMMÉDIATEMENT\n")
+            parts.append("   • Vérifier les logs système après mise à jour\n")
+            parts.append("   • Redémarrer si nécessaire\n")
+        elif security_machines > 0:
+            parts.append("⚠️  ACTION RECOMMANDÉE:\n")
+            parts.append("   • Planifier les mises à jour de sécurité\n")
+            parts.append("   • Appliquer les correctifs lors de la prochaine maintenance\n")
+        else:
+            parts.append("✅ SYSTÈME STABLE:\n")
+            parts.append("   • Continuer la surveillance régulière\n")
+            parts.append("   • Maintenir les bonnes pratiques de sécurité\n")
+
+        with open(report_file, 'w', encoding='utf-8', newline='\n', buffering=1024 * 1024) as f:
+            f.write("".join(parts))
 
         print(f"📄 Rapport généré: {report_file}")
         return report_file
 
-    def _get_status_text(self, status: str) -> str:
-        status_map = {
-            "critical": "🚨 CRITIQUE",
-            "security": "⚠️  SÉCURITÉ",
-            "regular": "📄 RÉGULIER",
-            "up-to-date": "✅ À JOUR",
-            "error": "❌ ERREUR",
-            "warning": "⚠️  AVERTISSEMENT"
-        }
-        return status_map.get(status, status)
-
-    def _generate_email_content(self) -> Tuple[str, str]:
-        total_machines = len(self.machines)
-        critical_machines = sum(1 for r in self.results.values() if r["status"] == "critical")
-        security_machines = sum(1 for r in self.results.values() if r["status"] == "security")
-        regular_machines = sum(1 for r in self.results.values() if r["status"] == "regular")
-        up_to_date_machines = sum(1 for r in self.results.values() if r["status"] == "up-to-date")
-
-        docker_machines = sum(
-            1 for r in self.results.values()
-            if r.get("docker", {}).get("has_docker")
-        )
-        docker_machines_outdated = sum(
-            1 for r in self.results.values()
-            if r.get("docker", {}).get("has_docker") and r["docker"].get("images_outdated", 0) > 0
+    def _sort_results(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Trie les résultats du plus grave au moins grave (ordre du fichier
+        machines.json à gravité égale). run() le calcule une seule fois et le
+        transmet au rapport, à l'email et au résumé final
+        """
+        position = {machine['name']: i for i, machine in enumerate(self.machines)}
+        last = len(position)
+        return sorted(
+            self.results.items(),
+            key=lambda kv: (
+                _SEVERITY_RANK.get(kv[1]["status"], len(_SEVERITY_RANK)),
+                position.get(kv[0], last),
+            ),
         )
-        disk_alert_machines = sum(
-            1 for r in self.results.values()
-            if r.get("disk", {}).get("alert")
+
+    def _summarize(self) -> Summary:
+        """
+        Agrège les statistiques de toutes les machines (statuts comptés par Counter,
+        Docker et disque en une boucle)
+        """
+        results = self.results.values()
+        # Comptage des statuts entièrement en C (Counter + itemgetter)
+        statuses = Counter(map(itemgetter("status"), results))
+
+        docker = docker_outdated = disk_alert = 0
+        for r in results:
+            d = r.get("docker") or _EMPTY
+            if d.get("has_docker"):
+                docker += 1
+                if d.get("images_outdated", 0) > 0:
+                    docker_outdated += 1
+            if (r.get("disk") or _EMPTY).get("alert"):
+                disk_alert += 1
+
+        return Summary(
+            successful=len(self.results) - statuses["error"],
+            critical=statuses["critical"],
+            security=statuses["security"],
+            regular=statuses["regular"],
+            up_to_date=statuses["up-to-date"],
+            docker=docker,
+            docker_outdated=docker_outdated,
+            disk_alert=disk_alert,
         )
 
-        text_content = f"SMAJS - Rapport de sécurité\nDate: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n\n"
-        text_content += f"Machines vérifiées: {total_machines}\n"
-        text_content += (
+    def _get_status_text(self, status: str) -> str:
+        return _STATUS_MAP.get(status, status)
+
+    def _generate_email_content(self, summary: Summary = None, ordered: List = None) -> Tuple[str, str]:
+        if ordered is None:
+            ordered = self._sort_results()
+        if not ordered:
+            return _EMPTY_TEXT, _EMPTY_HTML
+
+        if summary is None:
+            summary = self._summarize()
+        total_machines = len(self.machines)
+        disk_threshold = self.disk_threshold
+        critical_machines = summary.critical
+        security_machines = summary.security
+        regular_machines = summary.regular
+        up_to_date_machines = summary.up_to_date
+        docker_machines = summary.docker
+        docker_machines_outdated = summary.docker_outdated
+        disk_alert_machines = summary.disk_alert
+
+        buf = StringIO()
+        w = buf.write
+        w(f"SMAJS - Rapport de sécurité\nDate: {self._run_started_fmt}\n\n")
+        w(f"Machines vérifiées: {total_machines}\n")
+        w(
             f"Critiques: {critical_machines} | Sécurité: {security_machines} | "
             f"Régulières: {regular_machines} | À jour: {up_to_date_machines}\n"
         )
-        text_content += (
+        w(
             f"Docker: {docker_machines} machine(s) avec Docker, "
             f"{docker_machines_outdated} avec images potentiellement à mettre à jour\n"
         )
-        text_content += (
-            f"Disque: {disk_alert_machines} machine(s) avec au moins une partition à >={self.disk_threshold}% d'utilisation\n\n"
+        w(
+            f"Disque: {disk_alert_machines} machine(s) avec au moins une partition à >={disk_threshold}% d'utilisation\n\n"
         )
 
-        for name, result in self.results.items():
-            text_content += f"{name} ({result['ip']}) - {result['distribution']}\n"
-            text_content += f"Statut: {self._get_status_text(result['status'])}\n"
+        for name, result in ordered:
+            w(f"{name} ({result['ip']}) - {result['distribution']}\n")
+            w(f"Statut: {self._get_status_text(result['status'])}\n")
             if result["error"]:
-                text_content += f"Erreur: {result['error']}\n"
+                w(f"Erreur: {result['error']}\n")
             else:
                 updates = result["updates"]
-                text_content += (
+                w(
                     f"Mises à jour: {updates['total']} "
                     f"(Critiques: {updates['critical']}, "
                     f"Sécurité: {updates['security']}, "
                     f"Régulières: {updates['regular']})\n"
                 )
 
-            docker_info = result.get("docker", {})
+            docker_info = result.get("docker") or _EMPTY
             if docker_info.get("error"):
-                text_content += f"Docker: erreur lors de la vérification ({docker_info['error']})\n"
+                w(f"Docker: erreur lors de la vérification ({docker_info['error']})\n")
             elif docker_info.get("has_docker"):
                 if docker_info.get("containers", 0) > 0 or docker_info.get("images_total", 0) > 0:
-                    text_content += (
+                    w(
                         f"Docker: {docker_info.get('containers', 0)} conteneur(s), "
                         f"{docker_info.get('images_outdated', 0)} image(s) potentiellement à mettre à jour\n"
                     )
 
-            disk_info = result.get("disk", {})
+            disk_info = result.get("disk") or _EMPTY
             if disk_info.get("error"):
-                text_content += f"Disque: erreur lors de la vérification ({disk_info['error']})\n"
+                w(f"Disque: erreur lors de la vérification ({disk_info['error']})\n")
             elif disk_info.get("alert"):
-                text_content += "Disque: ALERTES (>= {0}% utilisé):\n".format(disk_info.get("threshold", self.disk_threshold))
+                w("Disque: ALERTES (>= {0}% utilisé):\n".format(disk_info.get("threshold", disk_threshold)))
                 for part in disk_info.get("partitions", []):
-                    text_content += (
+                    w(
                         f"  - {part['filesystem']} monté sur {part['mountpoint']}: "
                         f"{part['used_percent']}% utilisé\n"
                     )
 
-            text_content += "\n"
-
-        def status_color(status: str) -> str:
-            if status == "critical":
-                return "#FF4D4F"
-            if status == "security":
-                return "#FAAD14"
-            if status == "regular":
-                return "#1890FF"
-            if status == "up-to-date":
-                return "#52C41A"
-            return "#8c8c8c"
-
-        now_str = datetime.now().strftime('%d/%m/%Y à %H:%M:%S')
-
-        html = f"""
-<html>
-<body style="margin:0; padding:0; background-color:#0b0c10; font-family:'Segoe UI', Tahoma, sans-serif;">
-<div style="max-width:900px; margin:20px auto; background-color:#111320; border-radius:12px; overflow:hidden; box-shadow:0 4px 20px rgba(0,0,0,0.6); border:1px solid #1f2333;">
-
-    <div style="background:linear-gradient(135deg,#1c1f37 0%,#0b0c18 100%); padding:40px 30px; text-align:left; border-bottom:1px solid #262b40;">
-    <div style="display:flex; align-items:center;">
-        <div style="font-size:40px; margin-right:15px;">🔐</div>
-        <div>
-        <h1 style="color:#ffffff; margin:0; font-size:30px; letter-spacing:1px;">SMAJS</h1>
-        <p style="color:#4F62FF; margin:4px 0 0 0; font-size:13px; font-weight:bold; text-transform:uppercase;">
-            Suivi des mises à jour de sécurité
-        </p>
-        </div>
-    </div>
-    <p style="color:#9ca3c7; margin:18px 0 0 0; font-size:13px;">
-        Rapport généré le {now_str}
-    </p>
-    </div>
-
-    <div style="padding:25px 30px; background-color:#151729; border-bottom:1px solid #1f2333;">
-    <table cellpadding="0" cellspacing="0" style="width:100%; border-collapse:collapse;">
-        <tr>
-        <td style="padding:10px;">
-            <div style="background-color:#1f2236; border-radius:10px; padding:15px; text-align:center; border:1px solid {('#FF4D4F' if critical_machines else '#1f2333')};">
-            <div style="color:#FF4D4F; font-size:26px; font-weight:bold;">{critical_machines}</div>
-            <div style="color:#d9d9d9; font-size:13px; text-transform:uppercase; letter-spacing:1px; margin-top:4px;">🚨 Critiques</div>
-            </div>
-        </td>
-        <td style="padding:10px;">
-            <div style="background-color:#1f2236; border-radius:10px; padding:15px; text-align:center; border:1px solid {('#FAAD14' if security_machines else '#1f2333')};">
-            <div style="color:#FAAD14; font-size:26px; font-weight:bold;">{security_machines}</div>
-            <div style="color:#d9d9d9; font-size:13px; text-transform:uppercase; letter-spacing:1px; margin-top:4px;">⚠️ Sécurité</div>
-            </div>
-        </td>
-        <td style="padding:10px;">
-            <div style="background-color:#1f2236; border-radius:10px; padding:15px; text-align:center; border:1px solid #1f2333;">
-            <div style="color:#1890FF; font-size:26px; font-weight:bold;">{regular_machines}</div>
-            <div style="color:#d9d9d9; font-size:13px; text-transform:uppercase; letter-spacing:1px; margin-top:4px;">📄 Régulières</div>
-            </div>
-        </td>
-        <td style="padding:10px;">
-            <div style="background-color:#1f2236; border-radius:10px; padding:15px; text-align:center; border:1px solid #1f2333;">
-            <div style="color:#52C41A; font-size:26px; font-weight:bold;">{up_to_date_machines}</div>
-            <div style="color:#d9d9d9; font-size:13px; text-transform:uppercase; letter-spacing:1px; margin-top:4px;">✅ À jour</div>
-            </div>
-        </td>
-        </tr>
-    </table>
-    </div>
-
-    <div style="padding:10px 30px 0 30px; background-color:#151729; border-bottom:1px solid #1f2333;">
-        <table cellpadding="0" cellspacing="0" style="width:100%; border-collapse:collapse;">
-            <tr>
-                <td style="padding:8px 0; color:#9ca3c7; font-size:12px;">
-                    🐳 Docker :
-                    <span style="color:#ffffff; font-weight:600;">{docker_machines}</span> machine(s) avec Docker,
-                    <span style="color:{('#FAAD14' if docker_machines_outdated else '#9ca3c7')}; font-weight:600;">
-                        {docker_machines_outdated}</span> avec images potentiellement à mettre à jour
-                    <br/>
-                    💽 Disque :
-                    <span style="color:{('#FF4D4F' if disk_alert_machines else '#9ca3c7')}; font-weight:600;">
-                        {disk_alert_machines}</span> machine(s) avec au moins une partition à ≥{self.disk_threshold}% d'utilisation
-                </td>
-            </tr>
-        </table>
-    </div>
-
-    <div style="padding:30px;">
-    <h2 style="color:#ffffff; font-size:22px; margin:0 0 20px 0; border-left:5px solid #4F62FF; padding-left:12px;">
-        📋 ÉTAT DES SYSTÈMES
-    </h2>
-"""
-
-        if critical_machines > 0:
-            html += f"""
-    <div style="margin-bottom:25px; padding:18px 20px; border-radius:10px; background-color:#2d0002; border:1px solid #FF4D4F;">
-        <div style="color:#FF4D4F; font-weight:bold; font-size:15px; margin-bottom:6px;">🚨 ALERTE CRITIQUE</div>
-        <div style="color:#ffd6d6; font-size:13px;">
-        {critical_machines} machine(s) présente(nt) des mises à jour <strong>critiques</strong>. Une intervention immédiate est recommandée.
-        </div>
-    </div>
-"""
-
-        for name, result in self.results.items():
-            col_badge = status_color(result["status"])
-            updates = result["updates"]
-            status_text = self._get_status_text(result["status"])
-            docker_info = result.get("docker", {})
-
-            html += f"""
-    <div style="margin-bottom:22px; padding:20px; border-radius:12px; background-color:#151729; border:1px solid {col_badge};">
-        <table cellpadding="0" cellspacing="0" style="width:100%; border-collapse:collapse;">
-        <tr>
-            <td style="vertical-align:top;">
-            <div style="color:#ffffff; font-size:18px; font-weight:bold; margin-bottom:4px;">{name}</div>
-            <div style="color:#9ca3c7; font-size:13px; margin-bottom:8px; font-family:Consolas,monospace;">
-                {result['ip']} • {result['distribution']}
-            </div>
-            </td>
-            <td style="vertical-align:top; text-align:right;">
-            <span style="display:inline-block; padding:6px 12px; border-radius:999px; background-color:{col_badge}; color:#000; font-size:11px; font-weight:bold; text-transform:uppercase; letter-spacing:1px;">
-                {status_text}
-            </span>
-            </td>
-        </tr>
-        </table>
-
-        <table cellpadding="0" cellspacing="0" style="width:100%; border-collapse:collapse; margin-top:14px;">
-        <tr>
-            <td style="padding:6px 10px; color:#9ca3c7; font-size:12px;">Total MAJ</td>
-            <td style="padding:6px 10px; color:#ffffff; font-size:14px; font-weight:600;">{updates['total']}</td>
-            <td style="padding:6px 10px; color:#9ca3c7; font-size:12px;">Critiques</td>
-            <td style="padding:6px 10px; color:#FF4D4F; font-size:14px; font-weight:600;">{updates['critical']}</td>
-        </tr>
-        <tr>
-            <td style="padding:6px 10px; color:#9ca3c7; font-size:12px;">Sécurité</td>
-            <td style="padding:6px 10px; color:#FAAD14; font-size:14px; font-weight:600;">{updates['security']}</td>
-            <td style="padding:6px 10px; color:#9ca3c7; font-size:12px;">Régulières</td>
-            <td style="padding:6px 10px; color:#1890FF; font-size:14px; font-weight:600;">{updates['regular']}</td>
-        </tr>
-        </table>
-"""
-
-            if result["error"]:
-                html += f"""
-        <div style="margin-top:14px; padding:10px 12px; border-radius:8px; background-color:#2b1a1a; border:1px solid #aa3a3a; color:#ffd6d6; font-size:12px;">
-        ⚠️ Erreur lors de la vérification : {result['error']}
-        </div>
-"""
-            else:
-                crit_pkgs = result["packages"]["critical"][:6]
-                sec_pkgs = result["packages"]["security"][:6]
-
-                if crit_pkgs or sec_pkgs:
-                    html += '<div style="margin-top:14px;">'
+            w("\n")
 
-                    if crit_pkgs:
-                        html += """
-        <div style="margin-bottom:6px; color:#FF4D4F; font-size:12px; font-weight:bold;">Paquets critiques :</div>
-        <div style="margin-bottom:8px;">
-"""
-                        for p in crit_pkgs:
-                            html += f"""
-            <span style="display:inline-block; margin:2px 4px 2px 0; padding:4px 8px; border-radius:999px; background-color:#3a1113; color:#ffd6d6; font-size:11px; font-family:Consolas,monospace;">
-            {p}
-            </span>
-"""
-                        if len(result["packages"]["critical"]) > len(crit_pkgs):
-                            html += '<span style="color:#ffd6d6; font-size:11px;">…</span>'
-
-                    if sec_pkgs:
-                        html += """
-        <div style="margin-top:6px; margin-bottom:4px; color:#FAAD14; font-size:12px; font-weight:bold;">Paquets de sécurité :</div>
-        <div>
-"""
-                        for p in sec_pkgs:
-                            html += f"""
-            <span style="display:inline-block; margin:2px 4px 2px 0; padding:4px 8px; border-radius:999px; background-color:#3a2708; color:#ffe7b8; font-size:11px; font-family:Consolas,monospace;">
-            {p}
-            </span>
-"""
-                        if len(result["packages"]["security"]) > len(sec_pkgs):
-                            html += '<span style="color:#ffe7b8; font-size:11px;">…</span>'
-
-                    html += "</div>"
-
-            if docker_info.get("error"):
-                html += """
-        <div style="margin-top:14px; padding:10px 12px; border-radius:8px; background-color:#111320; border:1px dashed #1f2333; font-size:12px; color:#9ca3c7;">
-            <div style="margin-bottom:6px; font-weight:600; color:#4F62FF;">🐳 Docker</div>
-"""
-                html += f"""
-            <div style="color:#FF4D4F;">Erreur lors de la vérification Docker : {docker_info['error']}</div>
-        </div>
-"""
-            elif docker_info.get("has_docker") and (
-                docker_info.get("containers", 0) > 0 or docker_info.get("images_total", 0) > 0
-            ):
-                html += """
-        <div style="margin-top:14px; padding:10px 12px; border-radius:8px; background-color:#111320; border:1px dashed #1f2333; font-size:12px; color:#9ca3c7;">
-            <div style="margin-bottom:6px; font-weight:600; color:#4F62FF;">🐳 Docker</div>
-"""
-                html += f"""
-            <div>Conteneurs actifs : <span style="color:#ffffff; font-weight:600;">{docker_info.get('containers', 0)}</span></div>
-            <div>Images utilisées : <span style="color:#ffffff; font-weight:600;">{docker_info.get('images_total', 0)}</span></div>
-"""
-                if docker_info.get("images_outdated", 0) > 0:
-                    html += f"""
-            <div style="margin-top:6px;">
-                Images potentiellement à mettre à jour :
-                <span style="color:#FAAD14; font-weight:600;">{docker_info['images_outdated']}</span>
-            </div>
-            <div style="margin-top:4px;">
-"""
-                    for img in docker_info.get("outdated_images", [])[:4]:
-                        html += f"""
-                <span style="display:inline-block; margin:2px 4px 2px 0; padding:3px 8px; border-radius:999px; background-color:#1f2236; color:#e5e7eb; font-size:11px; font-family:Consolas,monospace;">
-                    {img}
-                </span>
-"""
-                    if docker_info["images_outdated"] > 4:
-                        html += """
-                <span style="color:#9ca3c7; font-size:11px;">…</span>
-"""
-                    html += """
-            </div>
-"""
-
-                html += """
-        </div>
-"""
-
-            disk_info = result.get("disk", {})
-            if disk_info.get("error"):
-                html += """
-        <div style="margin-top:14px; padding:10px 12px; border-radius:8px; background-color:#2b1a1a; border:1px solid #aa3a3a; font-size:12px; color:#ffd6d6;">
-            💽 Erreur lors de la vérification disque : {err}
-        </div>
-""".format(err=disk_info["error"])
-            elif disk_info.get("alert"):
-                html += """
-        <div style="margin-top:14px; padding:10px 12px; border-radius:8px; background-color:#111320; border:1px solid #FF4D4F; font-size:12px; color:#e5e7eb;">
-            <div style="margin-bottom:6px; font-weight:600; color:#FF4D4F;">💽 Alerte disque (>= {threshold}% utilisé)</div>
-""".format(threshold=disk_info.get("threshold", self.disk_threshold))
-                for part in disk_info.get("partitions", []):
-                    html += """
-            <div>
-                <span style="font-family:Consolas,monospace; color:#9ca3c7;">{fs}</span>
-                monté sur <span style="font-family:Consolas,monospace; color:#e5e7eb;">{mp}</span> :
-                <span style="color:#FF4D4F; font-weight:600;">{used}%</span> utilisé
-            </div>
-""".format(
-    fs=part["filesystem"],
-    mp=part["mountpoint"],
-    used=part["used_percent"]
-)
-                html += """
-        </div>
-"""
-
-            html += """
-    </div>
-"""
-
-        html += """
-    <div style="margin-top:30px; padding:18px 20px; border-radius:10px; background-color:#151729; border:1px solid #1f2333;">
-        <div style="color:#4F62FF; font-size:14px; font-weight:bold; margin-bottom:6px;">💡 Recommandations</div>
-        <div style="color:#d9d9d9; font-size:13px; line-height:1.6;">
-"""
-        if critical_machines > 0:
-            html += """
-        <strong>Action immédiate requise :</strong><br>
-        • Mettre à jour les paquets critiques URGEMMENT.<br>
-        • Redémarrer les services ou les machines après les mises à jour.
-"""
-        elif security_machines > 0:
-            html += """
-        <strong>Action recommandée :</strong><br>
-        • Planifier les mises à jour de sécurité sous 7 jours maximum.<br>
-        • Appliquer les correctifs lors de la prochaine fenêtre de maintenance.
-"""
-        else:
-            html += """
-        <strong>Système stable :</strong><br>
-        • Continuer la surveillance régulière des mises à jour.<br>
-        • Vérifier périodiquement les images Docker si utilisées en production.
-"""
+        text_content = buf.getvalue()
 
-        html += """
-        </div>
-    </div>
-    </div>
+        now_str = self._run_started.strftime('%d/%m/%Y à %H:%M:%S')
 
-    <div style="background-color:#0b0c16; padding:20px; text-align:center; color:#6b7280; font-size:11px; border-top:1px solid #1f2333;">
-    Ce rapport est généré automatiquement par <strong style="color:#4F62FF;">SMAJS</strong>.<br>
-    Script de suivi des mises à jour de sécurité créé par TBDwarf.
-    </div>
+        # Projection des résultats préparée en un seul passage : le gabarit
+        # n'a plus qu'à afficher des valeurs déjà calculées
+        machines = []
+        for name, r in ordered:
+            status = r["status"]
+            crit = r["packages"]["critical"]
+            sec = r["packages"]["security"]
+            machines.append({
+                "name": name,
+                "ip": r["ip"],
+                "distribution": r["distribution"],
+                "status_text": _STATUS_MAP.get(status, status),
+                "col_badge": _status_color(status),
+                "updates": r["updates"],
+                "error": r["error"],
+                "crit_pkgs": crit[:6],
+                "more_crit": len(crit) > 6,
+                "sec_pkgs": sec[:6],
+                "more_sec": len(sec) > 6,
+                "docker": r.get("docker") or _EMPTY,
+                "disk": r.get("disk") or _EMPTY,
+            })
+
+        # Couleurs d'accentuation de l'en-tête, décidées une fois ici
+        borders = {
+            "critical": "#FF4D4F" if critical_machines else "#1f2333",
+            "security": "#FAAD14" if security_machines else "#1f2333",
+            "docker": "#FAAD14" if docker_machines_outdated else "#9ca3c7",
+            "disk": "#FF4D4F" if disk_alert_machines else "#9ca3c7",
+        }
 
-</div>
-</body>
-</html>
-"""
+        html = _HTML_TEMPLATE.render(
+            machines=machines,
+            borders=borders,
+            now_str=now_str,
+            critical_machines=critical_machines,
+            security_machines=security_machines,
+            regular_machines=regular_machines,
+            up_to_date_machines=up_to_date_machines,
+            docker_machines=docker_machines,
+            docker_machines_outdated=docker_machines_outdated,
+            disk_alert_machines=disk_alert_machines,
+            disk_threshold=disk_threshold,
+        )
 
         return text_content, html
 
-    def _send_email(self, report_file: str):
+    def _send_email(self, report_file: str, content: Tuple[str, str] = None) -> bool:
+        """
+        Envoie le rapport par email ; retourne True si l'email est parti
+        """
+        if not self.results:
+            print("📧 Aucun résultat à envoyer, email ignoré.")
+            return False
+
+        # Imports différés : inutiles lorsque aucun email n'est envoyé
+        import smtplib
+        import ssl
+        from email.charset import Charset, QP, BASE64
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        from email.utils import formatdate
+
         smtp_config = self.config["smtp"]
+        host, port = smtp_config['server'], smtp_config['port']
+        username, password = smtp_config['username'], smtp_config['password']
+        subject_prefix = smtp_config['subject_prefix']
+        sender, recipient = smtp_config['sender'], smtp_config['recipient']
 
         try:
-            text_content, html_content = self._generate_email_content()
+            if content is None:
+                content = self._generate_email_content()
+            text_content, html_content = content
 
             msg = MIMEMultipart('alternative')
-            msg['Subject'] = f"{smtp_config['subject_prefix']} - {datetime.now().strftime('%d/%m/%Y')}"
-            msg['From'] = smtp_config['sender']
-            msg['To'] = smtp_config['recipient']
+            msg['Subject'] = f"{subject_prefix} - {self._run_started.strftime('%d/%m/%Y')}"
+            msg['From'] = sender
+            msg['To'] = recipient
             msg['Date'] = formatdate(localtime=True)
 
-            msg.attach(MIMEText(text_content, 'plain', 'utf-8'))
-            msg.attach(MIMEText(html_content, 'html', 'utf-8'))
+            # Texte (français, majoritairement ASCII) en quoted-printable,
+            # HTML en base64
+            text_charset = Charset('utf-8')
+            text_charset.body_encoding = QP
+            html_charset = Charset('utf-8')
+            html_charset.body_encoding = BASE64
 
-            with smtplib.SMTP_SSL(smtp_config['server'], smtp_config['port']) as server:
-                server.login(smtp_config['username'], smtp_config['password'])
+            msg.attach(MIMEText(text_content, 'plain', text_charset))
+            msg.attach(MIMEText(html_content, 'html', html_charset))
+
+            # Un seul email par exécution : connexion ouverte et fermée ici
+            with smtplib.SMTP_SSL(host, port, context=ssl.create_default_context()) as server:
+                server.login(username, password)
                 server.send_message(msg)
 
             print("📧 Rapport envoyé par email avec succès !")
+            return True
 
         except Exception as e:
             print(f"⚠️  Impossible d'envoyer l'email: {e}")
+            return False
+
+    def _print_machine_result(self, result: Dict[str, Any]):
+        """
+        Affiche le résultat de la vérification d'une machine
+        """
+        status_text = self._get_status_text(result["status"])
+        print(f"   Statut: {status_text}")
+
+        if not result["error"]:
+            updates = result["updates"]
+            if updates["total"] > 0:
+                print(f"   Mises à jour disponibles: {updates['total']}")
+                print(f"     • Critiques: {updates['critical']}")
+                print(f"     • Sécurité: {updates['security']}")
+                print(f"     • Régulières: {updates['regular']}")
+            else:
+                print(f"   ✅ Système à jour")
+
+            docker_info = result.get("docker") or _EMPTY
+            if docker_info.get("has_docker"):
+                print(f"   🐳 Docker: {docker_info.get('containers', 0)} conteneur(s), "
+                      f"{docker_info.get('images_outdated', 0)} image(s) potentiellement à mettre à jour")
+            elif docker_info.get("error"):
+                print(f"   🐳 Docker: erreur lors de la vérification ({docker_info['error']})")
+
+            disk_info = result.get("disk") or _EMPTY
+            if disk_info.get("alert"):
+                print("   💽 Alerte disque:")
+                for part in disk_info.get("partitions", []):
+                    print(f"     • {part['filesystem']} sur {part['mountpoint']}: {part['used_percent']}% utilisé")
+            elif disk_info.get("error"):
+                print(f"   💽 Disque: erreur lors de la vérification ({disk_info['error']})")
 
     def run(self):
+        self._set_run_started()
+
         print("🚀 SMAJS - Démarrage de la vérification")
         print("=" * 60)
-        print(f"📅 {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
+        print(f"📅 {self._run_started_fmt}")
         print(f"🔧 Machines à vérifier: {len(self.machines)}")
         print("=" * 60)
 
-        for i, machine in enumerate(self.machines, 1):
-            print(f"\n[{i}/{len(self.machines)}] Vérification de {machine['name']} ({machine['ip']})...")
-
-            result = self._check_machine(machine)
-            self.results[machine['name']] = result
-
-            status_text = self._get_status_text(result["status"])
-            print(f"   Statut: {status_text}")
+        # Vérifications en parallèle : le travail est dominé par l'attente réseau
+        if self.machines:
+            max_workers = min(self.max_parallel, len(self.machines))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self._check_machine, machine): machine
+                    for machine in self.machines
+                }
 
-            if not result["error"]:
-                updates = result["updates"]
-                if updates["total"] > 0:
-                    print(f"   Mises à jour disponibles: {updates['total']}")
-                    print(f"     • Critiques: {updates['critical']}")
-                    print(f"     • Sécurité: {updates['security']}")
-                    print(f"     • Régulières: {updates['regular']}")
-                else:
-                    print(f"   ✅ Système à jour")
+                for i, future in enumerate(as_completed(futures), 1):
+                    machine = futures[future]
+                    result = future.result()
+                    self.results[machine['name']] = result
 
-                docker_info = result.get("docker", {})
-                if docker_info.get("has_docker"):
-                    print(f"   🐳 Docker: {docker_info.get('containers', 0)} conteneur(s), "
-                          f"{docker_info.get('images_outdated', 0)} image(s) potentiellement à mettre à jour")
-                elif docker_info.get("error"):
-                    print(f"   🐳 Docker: erreur lors de la vérification ({docker_info['error']})")
+                    print(f"\n[{i}/{len(self.machines)}] {machine['name']} ({machine['ip']})")
+                    self._print_machine_result(result)
 
-                disk_info = result.get("disk", {})
-                if disk_info.get("alert"):
-                    print("   💽 Alerte disque:")
-                    for part in disk_info.get("partitions", []):
-                        print(f"     • {part['filesystem']} sur {part['mountpoint']}: {part['used_percent']}% utilisé")
-                elif disk_info.get("error"):
-                    print(f"   💽 Disque: erreur lors de la vérification ({disk_info['error']})")
+        if self.apt_refresh:
+            self._save_apt_refresh()
 
-            time.sleep(0.5)
+        # Tri et statistiques calculés une seule fois pour le rapport, l'email et le résumé
+        ordered = self._sort_results()
+        summary = self._summarize()
 
         print("\n" + "=" * 60)
         print("📊 Génération du rapport...")
-        report_file = self._generate_report()
+        report_file = self._generate_report(summary, ordered)
 
         print("\n🗑️  Nettoyage des anciens rapports...")
-        self._clean_old_reports()
+        self._clean_old_reports(keep=report_file)
 
         # Décision d'envoi du mail
-        critical_count = sum(1 for r in self.results.values() if r["status"] == "critical")
-        disk_alert_machines = sum(
-            1 for r in self.results.values()
-            if r.get("disk", {}).get("alert")
-        )
-        today_weekday = datetime.now().weekday()  # 0=lundi ... 6=dimanche
+        critical_count = summary.critical
+        disk_alert_machines = summary.disk_alert
+        today_weekday = self._run_started.weekday()  # 0=lundi ... 6=dimanche
         jour_rapport = self.config.get("planification", {}).get("jour_rapport", 4)
 
         doit_envoyer = False
@@ -1286,9 +1413,12 @@ class SMASJPro:
             doit_envoyer = True
             raison = "jour de rapport planifié"
 
+        email_envoye = False
         if doit_envoyer:
             print(f"\n📧 Envoi du rapport par email... ({raison})")
-            self._send_email(report_file)
+            # Le contenu de l'email n'est construit que s'il est réellement envoyé
+            content = self._generate_email_content(summary, ordered)
+            email_envoye = self._send_email(report_file, content)
         else:
             print("\n📧 Aucun email envoyé (pas de critiques, pas d'alerte disque et pas jour de rapport planifié).")
 
@@ -1298,23 +1428,25 @@ class SMASJPro:
 
         if critical_count > 0:
             print(f"\n🚨 ALERTE: {critical_count} machine(s) nécessite(nt) une action IMMÉDIATE !")
-            for name, result in self.results.items():
+            for name, result in ordered:
                 if result["status"] == "critical":
                     print(f"   • {name}: {result['updates']['critical']} paquet(s) critique(s)")
 
         # Résumé des alertes disque (optionnel mais utile)
         if disk_alert_machines > 0:
             print(f"\n💽 ALERTE DISQUE: {disk_alert_machines} machine(s) avec au moins une partition à >={self.disk_threshold}% d'utilisation !")
-            for name, result in self.results.items():
-                disk_info = result.get("disk", {})
+            for name, result in ordered:
+                disk_info = result.get("disk") or _EMPTY
                 if disk_info.get("alert"):
                     print(f"   • {name}:")
                     for part in disk_info.get("partitions", []):
                         print(f"       - {part['filesystem']} sur {part['mountpoint']}: {part['used_percent']}% utilisé")
 
         print(f"\n📄 Rapport disponible: {report_file}")
-        if doit_envoyer:
+        if email_envoye:
             print("📧 Rapport envoyé par email")
+        elif doit_envoyer:
+            print("📧 Rapport NON envoyé (échec de l'envoi ou aucun résultat)")
         else:
             print("📧 Rapport NON envoyé (condition de planification)")
         print("🗑️  Anciens rapports nettoyés")
@@ -0,0 +1,419 @@
+import json
+import os
+import shutil
+import smtplib
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import smajs
+
+
+class FakeChannel:
+    """
+    Canal SSH simulé : le code retour est disponible avant le dernier
+    bloc de données, et l'EOF n'arrive qu'après celui-ci
+    """
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.eof_received = False
+        self.closed = False
+        self.polls = 0
+
+    def exec_command(self, cmd):
+        pass
+
+    def sendall(self, data):
+        pass
+
+    def shutdown_write(self):
+        pass
+
+    def exit_status_ready(self):
+        return True
+
+    def recv_exit_status(self):
+        return 0
+
+    def _tick(self):
+        # Un bloc devient lisible à chaque attente, puis l'EOF
+        self.polls += 1
+        if self.polls > 1 and not self.chunks:
+            self.eof_received = True
+
+    def recv_ready(self):
+        return self.polls > 0 and bool(self.chunks)
+
+    def recv(self, n):
+        data = self.chunks.pop(0)
+        self.polls = 0
+        return data
+
+    def recv_stderr_ready(self):
+        return False
+
+    def recv_stderr(self, n):
+        return b""
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTransport:
+    def __init__(self, chan):
+        self.chan = chan
+
+    def open_session(self, timeout=None):
+        return self.chan
+
+
+class FakeSSH:
+    def __init__(self, chan):
+        self.chan = chan
+
+    def get_transport(self):
+        return FakeTransport(self.chan)
+
+
+class RunTest(unittest.TestCase):
+    def test_run_reads_until_eof_after_exit_status(self):
+        chan = FakeChannel([b"===OSREL===\nubuntu\n", b"===DF===\n/dev/sda1 100 95 5 95% /\n"])
+
+        pro = smajs.SMASJPro.__new__(smajs.SMASJPro)
+        with mock.patch.object(smajs.select, "select", lambda r, w, x, t: chan._tick()):
+            out = pro._run(FakeSSH(chan), "sh -s", stdin_data="")
+
+        self.assertIn("===DF===", out)
+        self.assertTrue(out.endswith("95% /\n"))
+        self.assertTrue(chan.closed)
+
+
+
+class EmailContentTest(unittest.TestCase):
+    def test_content_outside_run_lists_machines_by_severity(self):
+        pro = smajs.SMASJPro.__new__(smajs.SMASJPro)
+        pro.machines = [{"name": "ok", "ip": "10.0.0.1"}, {"name": "web", "ip": "10.0.0.2"}]
+        pro.disk_threshold = 80
+        pro._set_run_started()
+        pro.results = {
+            "ok": dict(pro._error_result("ok", "10.0.0.1", None, None), status="up-to-date"),
+            "web": dict(pro._error_result("web", "10.0.0.2", None, None), status="critical"),
+        }
+
+        text, html = pro._generate_email_content()
+
+        self.assertLess(text.index("web (10.0.0.2)"), text.index("ok (10.0.0.1)"))
+        self.assertIn("10.0.0.2", html)
+
+
+    def test_send_email_without_results_reports_not_sent(self):
+        pro = smajs.SMASJPro.__new__(smajs.SMASJPro)
+        pro.results = {}
+
+        with mock.patch("builtins.print"):
+            self.assertFalse(pro._send_email("rapport.txt"))
+
+
+
+class FakeSMTP:
+    instances = []
+
+    def __init__(self, host, port, context=None):
+        self.host, self.port, self.context = host, port, context
+        self.logged_in = False
+        self.sent = []
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+    def login(self, username, password):
+        self.logged_in = True
+
+    def send_message(self, msg):
+        self.sent.append(msg)
+
+
+class SmtpTest(unittest.TestCase):
+    def setUp(self):
+        FakeSMTP.instances = []
+        self.pro = smajs.SMASJPro.__new__(smajs.SMASJPro)
+        self.pro.config = {"smtp": {
+            "server": "smtp.example.com", "port": 465, "username": "u", "password": "p",
+            "sender": "s@example.com", "recipient": "r@example.com", "subject_prefix": "SMAJS",
+        }}
+        self.pro.results = {"web": {}}
+        self.pro._set_run_started()
+        patcher = mock.patch.object(smtplib, "SMTP_SSL", FakeSMTP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_send_opens_and_closes_one_tls_connection(self):
+        with mock.patch("builtins.print"):
+            self.assertTrue(self.pro._send_email("rapport.txt", ("Sécurité", "<p>html</p>")))
+
+        self.assertEqual(len(FakeSMTP.instances), 1)
+        server = FakeSMTP.instances[0]
+        self.assertIsNotNone(server.context)
+        self.assertTrue(server.logged_in and server.closed)
+        text_part, html_part = server.sent[0].get_payload()
+        self.assertEqual(text_part["Content-Transfer-Encoding"], "quoted-printable")
+        self.assertEqual(html_part["Content-Transfer-Encoding"], "base64")
+
+
+class CleanReportsTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        now = time.time()
+        # rapport_smajs_0 est le plus récent, rapport_smajs_4 le plus ancien (âges en jours)
+        for i in range(5):
+            path = os.path.join(self.dir, f"rapport_smajs_{i}.txt")
+            open(path, "w").close()
+            os.utime(path, (now - i * 86400, now - i * 86400))
+        open(os.path.join(self.dir, "autre.txt"), "w").close()
+
+        self.pro = smajs.SMASJPro.__new__(smajs.SMASJPro)
+        self.pro.report_dir = self.dir
+
+    def _clean(self, keep=None, **rapports):
+        self.pro.config = {"rapports": rapports}
+        with mock.patch("builtins.print"):
+            self.pro._clean_old_reports(keep=keep)
+        return sorted(os.listdir(self.dir))
+
+    def test_max_files_zero_keeps_everything(self):
+        self.assertEqual(len(self._clean(max_files=0)), 6)
+
+    def test_max_files_one_keeps_newest(self):
+        self.assertEqual(self._clean(max_files=1), ["autre.txt", "rapport_smajs_0.txt"])
+
+    def test_max_files_n_keeps_n_newest(self):
+        self.assertEqual(
+            self._clean(max_files=3),
+            ["autre.txt", "rapport_smajs_0.txt", "rapport_smajs_1.txt", "rapport_smajs_2.txt"],
+        )
+
+    def test_retention_and_max_files_combined(self):
+        # Les rapports de plus de 2,5 jours partent d'abord, puis la limite s'applique au reste
+        self.assertEqual(
+            self._clean(max_files=2, retention_jours=2.5),
+            ["autre.txt", "rapport_smajs_0.txt", "rapport_smajs_1.txt"],
+        )
+        self.assertEqual(
+            self._clean(max_files=5, retention_jours=0.5),
+            ["autre.txt", "rapport_smajs_0.txt"],
+        )
+
+    def test_invalid_retention_is_ignored(self):
+        for value in (-1, 0, "7", True):
+            self.assertEqual(len(self._clean(max_files=0, retention_jours=value)), 6)
+
+    def test_current_report_is_never_deleted(self):
+        current = os.path.join(self.dir, "rapport_smajs_4.txt")
+        remaining = self._clean(keep=current, max_files=1, retention_jours=0.5)
+        self.assertEqual(remaining, ["autre.txt", "rapport_smajs_4.txt"])
+
+
+
+def make_pro(directory, **overrides):
+    """
+    Instancie SMASJPro avec une configuration minimale écrite dans 'directory'
+    """
+    config = {
+        "smtp": {},
+        "rapports": {"max_files": 3, "dossier": os.path.join(directory, "rapports")},
+        "securite": {"paquets_critiques": ["openssl", "kernel"]},
+        "disque": {"seuil_alerte": 90},
+    }
+    config.update(overrides)
+    config_file = os.path.join(directory, "config.json")
+    machines_file = os.path.join(directory, "machines.json")
+    with open(config_file, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    with open(machines_file, "w", encoding="utf-8") as f:
+        json.dump({"machines": [{"name": "deb", "ip": "10.0.0.1", "username": "u", "password": "p"}]}, f)
+    return smajs.SMASJPro(config_file, machines_file)
+
+
+DEBIAN_OUTPUT = (
+    "===OSREL===\nPRETTY_NAME=\"Debian GNU/Linux 12\"\nID=debian\n"
+    "{refreshed}"
+    "===APT===\nListing...\n"
+    "openssl/stable-security 3.0.13-1 amd64 [upgradable from: 3.0.11-1]\n"
+    "===DF===\nFilesystem 1024-blocks Used Available Capacity Mounted on\n"
+    "/dev/sda1 100 10 90 10% /\n"
+)
+
+
+class AptRefreshTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.pro = make_pro(tmp.name, apt={"refresh": True, "intervalle_heures": 24})
+        self.machine = self.pro.machines[0]
+
+    def _check(self, output):
+        with mock.patch.object(smajs.socket, "create_connection"), \
+                mock.patch.object(smajs, "_ssh_connect"), \
+                mock.patch.object(self.pro, "_run", return_value=output), \
+                mock.patch("builtins.print"):
+            return self.pro._check_machine(self.machine)
+
+    def test_refresh_recorded_when_marker_present(self):
+        result = self._check(DEBIAN_OUTPUT.format(refreshed="===APT_REFRESHED===\n"))
+
+        self.assertEqual(result["status"], "critical")
+        self.assertIn("deb", self.pro.apt_refresh_times)
+
+    def test_refresh_not_recorded_when_update_failed(self):
+        result = self._check(DEBIAN_OUTPUT.format(refreshed=""))
+
+        self.assertEqual(result["status"], "critical")
+        self.assertNotIn("deb", self.pro.apt_refresh_times)
+        self.assertTrue(self.pro._apt_refresh_due("deb"))
+
+
+
+# Sortie enregistrée du script distant sur une Ubuntu avec Docker
+UBUNTU_OUTPUT = """===OSREL===
+PRETTY_NAME="Ubuntu 22.04.4 LTS"
+ID=ubuntu
+===APT===
+Listing...
+openssl/jammy-security 3.0.2-0ubuntu1.15 amd64 [upgradable from: 3.0.2-0ubuntu1.14]
+vim/jammy-updates 2:8.2.3995-1ubuntu2.16 amd64 [upgradable from: 2:8.2.3995-1ubuntu2.15]
+===DOCKER===
+web;;nginx:1.25
+db;;mongo:4.4.18
+cache;;redis
+===DF===
+Filesystem     1024-blocks     Used Available Capacity Mounted on
+/dev/sda1         41152736 39094100   2058636      95% /
+tmpfs               817596        0    817596       0% /run/user/1000
+/dev/sdb1        103080224 10308022  92772202      10% /mnt/Backup Disque
+"""
+
+
+class ParsersTest(unittest.TestCase):
+    def setUp(self):
+        self.pro = smajs.SMASJPro.__new__(smajs.SMASJPro)
+        self.pro.disk_threshold = 90
+
+    def test_split_sections(self):
+        sections = smajs._split_sections(UBUNTU_OUTPUT)
+
+        self.assertEqual(list(sections), ["OSREL", "APT", "DOCKER", "DF"])
+        self.assertIn("ID=ubuntu", sections["OSREL"])
+        self.assertIn("web;;nginx:1.25", sections["DOCKER"])
+
+    def test_missing_section(self):
+        output = UBUNTU_OUTPUT.split("===DOCKER===")[0]
+        sections = smajs._split_sections(output)
+
+        self.assertNotIn("DOCKER", sections)
+        self.assertFalse(self.pro._check_docker(None, "p", sections.get("DOCKER"))["has_docker"])
+        disk = self.pro._check_disk(sections.get("DF", ""))
+        self.assertEqual(disk["error"], "Aucune sortie de 'df'.")
+        self.assertFalse(disk["alert"])
+
+    def test_parse_apt_flags_security_lines(self):
+        all_packages, security = smajs._parse_apt(smajs._split_sections(UBUNTU_OUTPUT)["APT"])
+
+        self.assertEqual(len(all_packages), 2)
+        self.assertEqual(security, [all_packages[0]])
+        self.assertTrue(security[0].startswith("openssl/jammy-security"))
+
+    def test_parse_disk_keeps_mountpoint_with_spaces(self):
+        partitions = smajs._parse_disk(smajs._split_sections(UBUNTU_OUTPUT)["DF"])
+
+        self.assertEqual([p["mountpoint"] for p in partitions], ["/", "/mnt/Backup Disque"])
+        self.assertEqual(partitions[1]["used_percent"], 10)
+
+    def test_check_disk_alerts_above_threshold(self):
+        disk = self.pro._check_disk(smajs._split_sections(UBUNTU_OUTPUT)["DF"])
+
+        self.assertTrue(disk["alert"])
+        self.assertEqual([p["filesystem"] for p in disk["partitions"]], ["/dev/sda1"])
+
+    def test_check_docker_lists_tagged_images(self):
+        docker = self.pro._check_docker(None, "p", smajs._split_sections(UBUNTU_OUTPUT)["DOCKER"])
+
+        self.assertEqual((docker["containers"], docker["images_total"]), (3, 3))
+        # mongo:4.4.18 est ignorée, redis n'a pas de tag (latest)
+        self.assertEqual(docker["outdated_images"], ["nginx:1.25"])
+        self.assertIsNone(docker["error"])
+
+    def test_check_docker_permission_denied_falls_back_to_sudo_password(self):
+        denied = "\npermission denied while trying to connect to the Docker daemon socket\n"
+        with mock.patch.object(self.pro, "_run", return_value=("web;;nginx:1.25\n", "")) as run:
+            docker = self.pro._check_docker(object(), "secret", denied)
+
+        self.assertEqual(run.call_args.kwargs["stdin_data"], "secret\n")
+        self.assertEqual(docker["containers"], 1)
+        self.assertEqual(docker["outdated_images"], ["nginx:1.25"])
+
+    def test_check_docker_permission_denied_without_password(self):
+        denied = "\npermission denied while trying to connect to the Docker daemon socket\n"
+        docker = self.pro._check_docker(None, None, denied)
+
+        self.assertTrue(docker["has_docker"])
+        self.assertIn("aucun mot de passe", docker["error"])
+
+
+@unittest.skipUnless(shutil.which("bash"), "bash requis")
+class RemoteScriptDockerTest(unittest.TestCase):
+    """
+    Exécute la section Docker du script distant avec de faux docker/sudo
+    """
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.bin = tmp.name
+        self._tool("docker", 'echo "Got permission denied while trying to connect to the Docker daemon socket"; exit 1')
+        self._tool("sudo", '[ -n "$SUDO_OK" ] || exit 1; echo "web;;nginx:1.25"')
+
+    def _tool(self, name, body):
+        path = os.path.join(self.bin, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n" + body + "\n")
+        os.chmod(path, 0o755)
+
+    def _docker_section(self, sudo_ok):
+        env = dict(os.environ, PATH=self.bin + os.pathsep + os.environ["PATH"], SUDO_OK=sudo_ok)
+        out = subprocess.run(
+            ["bash", "--noprofile", "--norc", "-s"], input=smajs._REMOTE_CHECK_SCRIPT,
+            capture_output=True, text=True, env=env, check=True,
+        ).stdout
+        return smajs._split_sections(out)["DOCKER"]
+
+    def test_passwordless_sudo_output_is_used(self):
+        section = self._docker_section("1")
+
+        self.assertEqual(section.strip(), "web;;nginx:1.25")
+        pro = smajs.SMASJPro.__new__(smajs.SMASJPro)
+        with mock.patch.object(pro, "_run") as run:
+            docker = pro._check_docker(object(), "secret", section)
+        run.assert_not_called()
+        self.assertEqual(docker["containers"], 1)
+
+    def test_denied_output_kept_when_sudo_needs_password(self):
+        section = self._docker_section("")
+
+        self.assertIn("permission denied", section.lower())
+
+
+if __name__ == "__main__":
+    unittest.main()